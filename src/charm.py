@@ -3,8 +3,8 @@
 #
 # Learn more at: https://juju.is/docs/sdk
 
-import base64
-import configparser
+import binascii
+import hashlib
 import logging
 import os
 import re
@@ -12,7 +12,7 @@ import socket
 import subprocess
 import sys
 import traceback
-from typing import Any, Mapping
+from typing import Any, Mapping, Optional
 
 from charms.operator_libs_linux.v0 import apt
 from ops.charm import CharmBase
@@ -26,18 +26,37 @@ APT_CONF_OVERRIDE = "/etc/apt/apt.conf.d/99landscapeoverride"
 CERT_FILE = "/etc/ssl/certs/landscape_server_ca.crt"
 CLIENT_CONF_FILE = "/etc/landscape/client.conf"
 CLIENT_CONFIG_CMD = "/usr/bin/landscape-config"
+CLIENT_DATA_PATH = "/var/lib/landscape/client/"
 CLIENT_PACKAGE = "landscape-client"
+BROKER_PERSIST_FILE = "broker.bpickle"
 
-CHARM_ONLY_CONFIGS = {
-    "ppa",
-    "disable-unattended-upgrades",
-    "additional-client-configuration",
-}
+PEM_HEADER = b"-----BEGIN"
+
+CHARM_ONLY_CONFIGS = frozenset(
+    {
+        "ppa",
+        "disable-unattended-upgrades",
+        "additional-client-configuration",
+    }
+)
 """
 Configuration values that are only meaningful for the charm and should not be passed
 through to Landscape client.
 """
 
+_DASH_TO_UNDERSCORE = str.maketrans("-", "_")
+
+_SECTION_RE = re.compile(r"^\[([^\]]+)\]$")
+_KV_RE = re.compile(r"^([^=:;#\s][^=:]*?)\s*[=:]\s*(.*)$")
+
+_FAILURE_RE = re.compile(rb"failure", re.I)
+
+_CACHED_PYTHONPATH: Optional[tuple[int, str]] = None
+"""
+The PYTHONPATH built by `get_modified_env_vars`, along with the `sys.path` length it
+was built from.
+"""
+
 
 class ClientCharmError(Exception):
     pass
@@ -61,28 +80,43 @@ def log_info(text, event=None):
 
 def write_certificate(certificate, filename):
     """
-    @param certificate Text of the certificate, base64 encoded.
+    @param certificate Certificate data, already decoded from base64.
     @param filename Full path to file to write
     """
-    with open(filename, "wb") as file:
-        file.write(base64.b64decode(certificate))
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(certificate)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
 
 
 def parse_ssl_arg(value):
     """
-    Check for file, return if exists.
-    Otherwise decode from base64 and write to_location
+    Decode from base64 and write to CERT_FILE if this is a PEM certificate.
+    Otherwise check for file, return if exists, and fall back to writing
+    whatever the value decodes to
     """
-    if os.path.isfile(value):
-        return value
     try:
-        write_certificate(value, CERT_FILE)
-        value = CERT_FILE
+        data = binascii.a2b_base64(value)
+    except ValueError:  # binascii.Error, or a non-ASCII str such as a path
+        data = None
+
+    if data is None or not data.startswith(PEM_HEADER):
+        if os.path.isfile(value):
+            return value
+        if data is None:
+            log_error("Cert {} does not exist!".format(value))
+            raise ClientCharmError("Certificate does not exist!")
+
+    try:
+        write_certificate(data, CERT_FILE)
     except OSError:
         log_error("Cert {} does not exist!".format(value))
         raise ClientCharmError("Certificate does not exist!")
 
-    return value
+    return CERT_FILE
 
 
 def get_modified_env_vars():
@@ -97,7 +131,24 @@ def get_modified_env_vars():
     return env_vars
 
 
-def process_helper(args, hide_errors=False, env=get_modified_env_vars()):
+def _cached_modified_env_vars():
+    """
+    Return a copy of the current env vars with the PYTHONPATH from
+    `get_modified_env_vars`, only rebuilding that path when the length of
+    `sys.path` has changed since the last call
+    """
+    global _CACHED_PYTHONPATH
+    if _CACHED_PYTHONPATH is not None and _CACHED_PYTHONPATH[0] == len(sys.path):
+        env_vars = os.environ.copy()
+        env_vars["PYTHONPATH"] = _CACHED_PYTHONPATH[1]
+        return env_vars
+
+    env_vars = get_modified_env_vars()
+    _CACHED_PYTHONPATH = (len(sys.path), env_vars["PYTHONPATH"])
+    return env_vars
+
+
+def process_helper(args, hide_errors=False, env=None):
     """
     Grabs all outputs and exceptions from subprocess and look for
     keywords that indicate failure and return if successful or not
@@ -105,40 +156,111 @@ def process_helper(args, hide_errors=False, env=get_modified_env_vars()):
     is used for commands that are expected to return non-zero
     """
     log_info(args)
+    if env is None:
+        env = _cached_modified_env_vars()
     try:
-        p = subprocess.Popen(
-            args, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, text=True, env=env
+        p = subprocess.run(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            bufsize=-1,
+            check=False,
         )
     except Exception:
         log_error(traceback.format_exc())
         return False
-    output, error = p.communicate()
-    if p.returncode != 0 or "Failure" in output:
+    output = p.stdout
+    if p.returncode != 0 or _FAILURE_RE.search(output) is not None:
         if not hide_errors:
-            log_error("".join(traceback.format_stack()))
-            log_error(output)
-            log_error(error)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("stack:\n%s", "".join(traceback.format_stack()))
+            log_error(output.decode(errors="replace"))
         return False
     else:
-        log_info(output)
+        log_info(output.decode(errors="replace"))
         return True
 
 
+def _parse_config(lines: list[str]) -> dict[str, dict[str, str]]:
+    """
+    Parse INI-style `lines` into a dict per section, following ConfigParser's
+    defaults: keys are lowercased, both `=` and `:` separate keys from values, and
+    lines indented deeper than their key continue its value, including any blank
+    lines in between. Comment lines are skipped. `[DEFAULT]` is returned as a
+    section of its own; its values are not copied into the other sections.
+
+    Raise `ClientCharmError` for any other line that cannot be parsed.
+    """
+    config: dict[str, dict[str, list[str]]] = {}
+    section = None
+    key = None
+    indent = 0
+    for line in lines:
+        stripped = line.strip()
+        if stripped[:1] in ("#", ";"):
+            continue
+        if not stripped:
+            if key is not None:
+                section[key].append("")
+            continue
+
+        line_indent = len(line) - len(line.lstrip())
+        if key is not None and line_indent > indent:
+            section[key].append(stripped)
+            continue
+
+        indent = line_indent
+        if match := _SECTION_RE.match(stripped):
+            section = config.setdefault(match[1], {})
+            key = None
+        elif section is not None and (match := _KV_RE.match(stripped)):
+            key = match[1].lower()
+            section[key] = [match[2]]
+        else:
+            raise ClientCharmError(f"Malformed configuration line: {repr(line)}")
+
+    return {
+        name: {k: "\n".join(v).rstrip() for k, v in values.items()}
+        for name, values in config.items()
+    }
+
+
 def merge_client_config(conf_file: str, client_config: Mapping[str, Any]):
     """
     Read the contents of the [client] section in `conf_file` and merge `client_config`,
     overwriting existing values.
+
+    Return the merged [client] section, including the values it inherits from
+    [DEFAULT].
     """
-    config = configparser.ConfigParser()
-    config.read(conf_file)
+    try:
+        st = os.stat(conf_file)
+    except FileNotFoundError:
+        st = None
+
+    if st is None or st.st_size == 0:
+        lines = []
+    else:
+        with open(conf_file, "r") as configfile:
+            lines = configfile.read().splitlines()
+
+    config = _parse_config(lines)
+    client = config.setdefault("client", {})
+    client.update({k: str(v) for k, v in client_config.items() if v})
 
-    config["client"].update({k: str(v) for k, v in client_config.items() if v})
+    out = []
+    for name, values in config.items():
+        out.append(f"[{name}]")
+        # Continue multi-line values on indented lines, as ConfigParser.write does
+        out.extend(f"{k} = {v}".replace("\n", "\n\t") for k, v in values.items())
+        out.append("")
 
     with open(conf_file, "w") as configfile:
-        config.write(configfile)
+        configfile.write("\n".join(out) + "\n")
 
-    c = {s: dict(config[s]) for s in config.sections()}
-    logger.info(f"Client configuration merged. Current value: {c}")
+    logger.info(f"Client configuration merged. Current value: {client}")
+    return {**config.get("DEFAULT", {}), **client}
 
 
 def get_additional_client_configuration(
@@ -146,33 +268,27 @@ def get_additional_client_configuration(
 ) -> dict[str, Any]:
     """
     Parse the `additional-client-configuration` option from the Juju configuration
-    and return key-value pairs.
+    and return the key-value pairs of its [client] section, including the values it
+    inherits from [DEFAULT].
 
     Return an empty dictionary if the `additional-client-configuration` option is not
-    provided or cannot be parsed.
+    provided, and raise `ClientCharmError` if it cannot be parsed.
     """
     raw = juju_config.get("additional-client-configuration")
     logger.debug(f"Received additional-client-configuration: {repr(raw)}")
     if not raw:
         return {}
 
-    config = configparser.ConfigParser()
-
     try:
-        config.read_string(raw)
-    except configparser.MissingSectionHeaderError as e:
+        config = _parse_config(raw.splitlines())
+        client_config = {**config.get("DEFAULT", {}), **config["client"]}
+    except (ClientCharmError, KeyError) as e:
         raise ClientCharmError(
             f"Malformed additional-client-configuration: {repr(raw)}"
         ) from e
 
-    try:
-        client_config = dict(config["client"])
-        logger.debug(f"Parsed additional-client-configuration: {client_config}")
-        return client_config
-    except KeyError as e:
-        raise ClientCharmError(
-            f"Malformed additional-client-configuration: {repr(raw)}"
-        ) from e
+    logger.debug(f"Parsed additional-client-configuration: {client_config}")
+    return client_config
 
 
 def create_client_config(
@@ -189,7 +305,7 @@ def create_client_config(
     values are underscore-separated.
     """
     client_config = {
-        key.replace("-", "_"): value
+        key.translate(_DASH_TO_UNDERSCORE): value
         for key, value in juju_config.items()
         if key not in CHARM_ONLY_CONFIGS
     }
@@ -221,7 +337,16 @@ class LandscapeClientCharm(CharmBase):
         )
         self.framework.observe(self.on.upgrade_action, self._upgrade)
         self.framework.observe(self.on.register_action, self._register)
-        self._stored.set_default(things=[])
+        self._stored.set_default(things=[], last_config_hash="", hostname="")
+
+    @property
+    def hostname(self):
+        """
+        The hostname of this unit, kept across hooks and refreshed on install
+        """
+        if not self._stored.hostname:
+            self._stored.hostname = socket.gethostname()
+        return self._stored.hostname
 
     def add_ppa(self):
         landscape_ppa = self.config.get("ppa")
@@ -270,17 +395,46 @@ class LandscapeClientCharm(CharmBase):
         """
         Gets and processes the landscape client config args
         from the charm configuration
+
+        Returns the merged [client] section of the client configuration file, or
+        None if the configuration is unchanged since it was last applied
         """
         client_config = create_client_config(
             juju_config=self.config,
-            default_computer_title=socket.gethostname(),
+            default_computer_title=self.hostname,
         )
         log_info(client_config)
-        merge_client_config(CLIENT_CONF_FILE, client_config)
+
+        # The charm config is hashed as well so that a new certificate written to
+        # the same path is still seen as a change
+        config_hash = hashlib.blake2b(
+            repr((sorted(client_config.items()), sorted(self.config.items()))).encode(),
+            digest_size=16,
+        ).hexdigest()
+        if config_hash == self._stored.last_config_hash:
+            log_info("client config unchanged; skipping merge")
+            return None
+
+        merged = merge_client_config(CLIENT_CONF_FILE, client_config)
+        self._stored.last_config_hash = config_hash
+        return merged
 
     def is_registered(self):
         return process_helper([CLIENT_CONFIG_CMD, "--is-registered"], hide_errors=True)
 
+    def _is_registered_cheap(self, client_config):
+        """
+        Landscape client persists its registration in the broker state file under
+        its data path, so a client without that file cannot be registered and
+        `landscape-config --is-registered` does not need to be run
+
+        @param client_config The merged [client] section of the client configuration
+        """
+        data_path = client_config.get("data_path") or CLIENT_DATA_PATH
+        if not os.path.isfile(os.path.join(data_path, BROKER_PERSIST_FILE)):
+            return False
+        return self.is_registered()
+
     def send_registration(self):
         if process_helper([CLIENT_CONFIG_CMD, "--silent"]):
             self.unit.status = ActiveStatus("Client registered!")
@@ -289,14 +443,23 @@ class LandscapeClientCharm(CharmBase):
 
     def run_landscape_client(self):
         self.unit.status = MaintenanceStatus("Configuring landscape client..")
-        self.set_client_config()
-        if self.is_registered():
-            process_helper(["systemctl", "restart", "landscape-client"])
+        client_config = self.set_client_config()
+        if client_config is None:
+            registered = self.is_registered()
+        else:
+            registered = self._is_registered_cheap(client_config)
+
+        if registered:
+            if client_config is not None:
+                process_helper(["systemctl", "restart", "landscape-client"])
             self.unit.status = ActiveStatus("Client config updated!")
         else:
             self.send_registration()
 
     def _on_install(self, _):
+        self._stored.hostname = socket.gethostname()
+        # A reinstalled package ships a fresh client.conf
+        self._stored.last_config_hash = ""
         try:
             self.add_ppa()
             self.install_landscape_client()
@@ -327,6 +490,8 @@ class LandscapeClientCharm(CharmBase):
         """Disable landscape client when relation is broken"""
         self.unit.status = MaintenanceStatus("Disabling landscape client..")
         process_helper([CLIENT_CONFIG_CMD, "--silent", "--disable"])
+        # Make the next config-changed re-apply the config and restart the client
+        self._stored.last_config_hash = ""
 
     def _upgrade(self, event):
         if isinstance(self.unit.status, MaintenanceStatus):
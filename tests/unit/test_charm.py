@@ -2,7 +2,9 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 import base64
+import configparser
 import os
+import subprocess
 import tempfile
 import unittest
 from unittest import mock
@@ -19,6 +21,8 @@ from charm import (
     create_client_config,
     get_additional_client_configuration,
     get_modified_env_vars,
+    merge_client_config,
+    process_helper,
 )
 
 
@@ -26,6 +30,7 @@ class TestCharm(unittest.TestCase):
     def setUp(self):
         self.harness = Harness(LandscapeClientCharm)
         self.addCleanup(self.harness.cleanup)
+        self.addCleanup(mock.patch.stopall)
 
         self.process_mock = mock.patch("charm.process_helper").start()
         self.apt_mock = mock.patch("charm.apt.add_package").start()
@@ -39,6 +44,13 @@ class TestCharm(unittest.TestCase):
         self.harness.begin_with_initial_hooks()
         self.apt_mock.assert_called_once_with("landscape-client")
 
+    def test_install_resets_config_hash(self):
+        """The client config is re-applied after the package is (re)installed"""
+        self.harness.begin()
+        self.harness.charm._stored.last_config_hash = "abc"
+        self.harness.charm.on.install.emit()
+        self.assertEqual("", self.harness.charm._stored.last_config_hash)
+
     def test_install_error(self):
         self.apt_mock.side_effect = Exception
         self.from_installed_package_mock.side_effect = apt.PackageNotFoundError
@@ -48,7 +60,7 @@ class TestCharm(unittest.TestCase):
         self.assertEqual(status.message, "Failed to install client!")
         self.assertIsInstance(status, BlockedStatus)
 
-    @mock.patch("charm.merge_client_config")
+    @mock.patch("charm.merge_client_config", return_value={})
     @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=False)
     def test_run(self, is_registered_mock, merge_client_config_mock):
         """Test args get passed correctly to landscape-config and registers"""
@@ -63,8 +75,9 @@ class TestCharm(unittest.TestCase):
         self.assertEqual(status.message, "Client registered!")
         self.assertIsInstance(status, ActiveStatus)
 
+    @mock.patch("charm.os.path.isfile", return_value=True)
     @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
-    def test_restart_if_registered(self, is_registered_mock):
+    def test_restart_if_registered(self, is_registered_mock, isfile_mock):
         """Restart client if it's registered"""
         self.harness.begin()
         self.harness.update_config({})
@@ -72,6 +85,76 @@ class TestCharm(unittest.TestCase):
             ["systemctl", "restart", "landscape-client"]
         )
 
+    @mock.patch("charm.merge_client_config", return_value={})
+    @mock.patch("charm.os.path.isfile", return_value=True)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_unchanged_config_skipped(
+        self, is_registered_mock, isfile_mock, merge_client_config_mock
+    ):
+        """
+        The client config is not merged again, and the client is not restarted,
+        when the config has not changed since it was last applied
+        """
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1"})
+        self.harness.update_config({"computer-title": "hello1"})
+        merge_client_config_mock.assert_called_once()
+        self.process_mock.assert_called_once_with(
+            ["systemctl", "restart", "landscape-client"]
+        )
+
+        self.harness.update_config({"computer-title": "hello2"})
+        self.assertEqual(merge_client_config_mock.call_count, 2)
+        self.assertEqual(self.process_mock.call_count, 2)
+
+    @mock.patch("charm.merge_client_config", return_value={"data_path": "/data/"})
+    @mock.patch("charm.os.path.isfile", return_value=False)
+    @mock.patch("charm.LandscapeClientCharm.is_registered")
+    def test_not_registered_without_broker_state(
+        self, is_registered_mock, isfile_mock, merge_client_config_mock
+    ):
+        """
+        `landscape-config --is-registered` is skipped when the client has no
+        persisted broker state, and the client is registered
+        """
+        self.harness.begin()
+        self.harness.update_config({"data-path": "/data/"})
+        isfile_mock.assert_called_once_with("/data/broker.bpickle")
+        is_registered_mock.assert_not_called()
+        self.process_mock.assert_called_once_with([CLIENT_CONFIG_CMD, "--silent"])
+
+    @mock.patch("charm.merge_client_config", return_value={"data_path": "/srv/x"})
+    @mock.patch("charm.os.path.isfile", return_value=True)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_broker_state_checked_in_merged_data_path(
+        self, is_registered_mock, isfile_mock, merge_client_config_mock
+    ):
+        """
+        The broker state is looked for in the data path from the merged client
+        configuration, which can still hold a value no longer set in the charm
+        """
+        self.harness.begin()
+        self.harness.update_config({})
+        isfile_mock.assert_called_once_with("/srv/x/broker.bpickle")
+        is_registered_mock.assert_called_once_with()
+        self.process_mock.assert_called_once_with(
+            ["systemctl", "restart", "landscape-client"]
+        )
+
+    @mock.patch("charm.merge_client_config", return_value={})
+    @mock.patch("charm.socket.gethostname", return_value="myhost")
+    def test_hostname_cached(self, gethostname_mock, merge_client_config_mock):
+        """
+        The hostname is only looked up once and used as the default computer title
+        """
+        self.harness.begin()
+        self.harness.update_config({"url": "url1"})
+        self.harness.update_config({"url": "url2"})
+        gethostname_mock.assert_called_once_with()
+        self.assertEqual(
+            "myhost", merge_client_config_mock.call_args.args[1]["computer_title"]
+        )
+
     def test_ppa_added(self):
         self.harness.begin()
         self.harness.update_config({"ppa": "ppa"})
@@ -131,15 +214,20 @@ class TestCharm(unittest.TestCase):
             env=env_variables,
         )
 
-    @mock.patch("charm.merge_client_config")
+    @mock.patch("charm.merge_client_config", return_value={})
     def test_ppa_not_in_args(self, merge_client_config_mock):
         """Test that the ppa arg does not end up in the landscape config"""
         self.harness.begin()
         self.harness.update_config({"ppa": "testppa"})
         self.assertNotIn("ppa", merge_client_config_mock.call_args.args[1])
 
-    @mock.patch("charm.merge_client_config")
-    def test_ssl_public_key(self, merge_client_config_mock):
+    @mock.patch("charm.os.close")
+    @mock.patch("charm.os.write", return_value=5)
+    @mock.patch("charm.os.open", return_value=3)
+    @mock.patch("charm.merge_client_config", return_value={})
+    def test_ssl_public_key(
+        self, merge_client_config_mock, os_open_mock, os_write_mock, os_close_mock
+    ):
         """Test that the base64 encoded ssl cert gets written successfully"""
 
         self.harness.begin()
@@ -148,10 +236,19 @@ class TestCharm(unittest.TestCase):
         data_b64 = base64.b64encode(data).decode()  # no 'base64:' prefix
         self.harness.update_config({"ssl-public-key": data_b64})
 
-        self.open_mock().write.assert_called_once_with(data)
-
-    @mock.patch("charm.merge_client_config")
-    def test_ssl_cert(self, merge_client_config_mock):
+        os_open_mock.assert_called_once_with(
+            charm.CERT_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644
+        )
+        os_write_mock.assert_called_once_with(3, data)
+        os_close_mock.assert_called_once_with(3)
+
+    @mock.patch("charm.os.close")
+    @mock.patch("charm.os.write", return_value=5)
+    @mock.patch("charm.os.open", return_value=3)
+    @mock.patch("charm.merge_client_config", return_value={})
+    def test_ssl_cert(
+        self, merge_client_config_mock, os_open_mock, os_write_mock, os_close_mock
+    ):
         """Test that the base64 encoded ssl cert gets written successfully"""
 
         self.harness.begin()
@@ -160,10 +257,47 @@ class TestCharm(unittest.TestCase):
         data_b64 = base64.b64encode(data).decode()  # no 'base64:' prefix
         self.harness.update_config({"ssl-ca": data_b64})
 
-        self.open_mock().write.assert_called_once_with(data)
+        os_open_mock.assert_called_once_with(
+            charm.CERT_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644
+        )
+        os_write_mock.assert_called_once_with(3, data)
+        os_close_mock.assert_called_once_with(3)
+
+    @mock.patch("charm.os.close")
+    @mock.patch("charm.os.write", side_effect=[2, 3])
+    @mock.patch("charm.os.open", return_value=3)
+    def test_write_certificate_short_write(
+        self, os_open_mock, os_write_mock, os_close_mock
+    ):
+        """Writing the certificate continues after a short write"""
+        charm.write_certificate(b"hello", "/tmp/cert")
+        self.assertEqual(
+            [mock.call(3, b"hello"), mock.call(3, b"llo")],
+            os_write_mock.call_args_list,
+        )
+        os_close_mock.assert_called_once_with(3)
+
+    @mock.patch("charm.os.path.isfile")
+    @mock.patch("charm.write_certificate")
+    @mock.patch("charm.merge_client_config", return_value={})
+    def test_ssl_cert_pem_skips_isfile(
+        self, merge_client_config_mock, write_certificate_mock, isfile_mock
+    ):
+        """A base64 encoded PEM certificate is written without checking for a file"""
+        self.harness.begin()
+
+        data = b"-----BEGIN CERTIFICATE-----\nMIIB\n-----END CERTIFICATE-----\n"
+        data_b64 = base64.b64encode(data).decode()
+        self.harness.update_config({"ssl-ca": data_b64})
+
+        self.assertNotIn(mock.call(data_b64), isfile_mock.call_args_list)
+        write_certificate_mock.assert_called_once_with(data, charm.CERT_FILE)
+        self.assertEqual(
+            charm.CERT_FILE, merge_client_config_mock.call_args.args[1]["ssl_ca"]
+        )
 
     @mock.patch("charm.os.path.isfile", return_value=True)
-    @mock.patch("charm.merge_client_config")
+    @mock.patch("charm.merge_client_config", return_value={})
     def test_ssl_cert_valid_path(self, merge_client_config_mock, _):
         self.harness.begin()
         self.harness.update_config(
@@ -174,8 +308,18 @@ class TestCharm(unittest.TestCase):
             merge_client_config_mock.call_args.args[1]["ssl_ca"],
         )
 
+    @mock.patch("charm.os.path.isfile", return_value=True)
+    @mock.patch("charm.merge_client_config", return_value={})
+    def test_ssl_cert_non_ascii_path(self, merge_client_config_mock, _):
+        self.harness.begin()
+        self.harness.update_config({"ssl-ca": "/etc/ssl/cért.pem"})
+        self.assertEqual(
+            "/etc/ssl/cért.pem",
+            merge_client_config_mock.call_args.args[1]["ssl_ca"],
+        )
+
     @mock.patch("charm.os.path.isfile", return_value=False)
-    @mock.patch("charm.merge_client_config")
+    @mock.patch("charm.merge_client_config", return_value={})
     @mock.patch("charm.write_certificate", side_effect=OSError("write failed"))
     def test_ssl_cert_oserror(
         self, _write_certificate, merge_client_config_mock, _isfile
@@ -195,6 +339,29 @@ class TestCharm(unittest.TestCase):
             [CLIENT_CONFIG_CMD, "--silent", "--disable"]
         )
 
+    @mock.patch("charm.merge_client_config", return_value={})
+    @mock.patch("charm.os.path.isfile", return_value=True)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_config_reapplied_after_relation_departed(
+        self, is_registered_mock, isfile_mock, merge_client_config_mock
+    ):
+        """
+        After the client is disabled by the relation departing, the next
+        config-changed restarts it even if the config is unchanged
+        """
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1"})
+        rel_id = self.harness.add_relation("container", "ubuntu")
+        self.harness.add_relation_unit(rel_id, "ubuntu/0")
+        self.harness.remove_relation_unit(rel_id, "ubuntu/0")
+        self.process_mock.reset_mock()
+
+        self.harness.update_config({"computer-title": "hello1"})
+        self.assertEqual(merge_client_config_mock.call_count, 2)
+        self.process_mock.assert_called_once_with(
+            ["systemctl", "restart", "landscape-client"]
+        )
+
     def test_action_upgrade(self):
         self.harness.begin()
         self.harness.charm.unit.status = ActiveStatus("Active")
@@ -236,6 +403,13 @@ class TestCharm(unittest.TestCase):
         """
         Test that update config writes a new value and doesn't change previous ones
         """
+        real_stat = os.stat
+        stat_mock = mock.patch("charm.os.stat").start()
+        stat_mock.side_effect = lambda path, *args, **kwargs: (
+            mock.Mock(st_size=100)
+            if path == charm.CLIENT_CONF_FILE
+            else real_stat(path, *args, **kwargs)
+        )
         self.open_mock.side_effect = mock.mock_open(
             read_data="[client]\naccount_name = onward"
         )
@@ -266,7 +440,30 @@ class TestCharm(unittest.TestCase):
         self.assertNotEqual(result, os.environ)
         self.assertIn("PYTHONPATH", result)
 
-    @mock.patch("charm.merge_client_config")
+    @mock.patch("charm._CACHED_PYTHONPATH", new=None)
+    @mock.patch("charm.sys.path", new=["/usr/bin", "/juju/path"])
+    @mock.patch("charm.os.environ", new={"PYTHONPATH": "/initial/path"})
+    def test_modified_env_vars_cached(self):
+        """
+        The modified PYTHONPATH is reused until `sys.path` changes, while other
+        env vars always reflect the current environment
+        """
+        with mock.patch(
+            "charm.get_modified_env_vars", wraps=get_modified_env_vars
+        ) as get_modified_env_vars_mock:
+            charm._cached_modified_env_vars()
+            charm.os.environ["http_proxy"] = "http://proxy.test:3128"
+            env = charm._cached_modified_env_vars()
+            get_modified_env_vars_mock.assert_called_once_with()
+
+        self.assertEqual(env["PYTHONPATH"], "/usr/bin")
+        self.assertEqual(env["http_proxy"], "http://proxy.test:3128")
+
+        charm.sys.path.append("/another/path")
+        env = charm._cached_modified_env_vars()
+        self.assertEqual(env["PYTHONPATH"], "/usr/bin:/another/path")
+
+    @mock.patch("charm.merge_client_config", return_value={})
     def test_additional_config(self, merge_client_config_mock):
         """
         Arbitrary configuration can be provided in a `additional_config`
@@ -284,7 +481,7 @@ class TestCharm(unittest.TestCase):
         self.assertIn(("computer_title", "hello1"), client_config)
         self.assertIn(("somekey", "someval"), client_config)
 
-    @mock.patch("charm.merge_client_config")
+    @mock.patch("charm.merge_client_config", return_value={})
     def test_empty_additional_config(self, merge_client_config_mock):
         """
         Empty additional configuration has no effect.
@@ -340,6 +537,195 @@ class TestCreateClientConfig(unittest.TestCase):
         )
 
 
+class TestProcessHelper(unittest.TestCase):
+
+    def setUp(self):
+        self.run_mock = mock.patch("charm.subprocess.run").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_success(self):
+        self.run_mock.return_value = mock.Mock(returncode=0, stdout=b"ok")
+        self.assertTrue(process_helper(["true"], env={}))
+        self.run_mock.assert_called_once_with(
+            ["true"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env={},
+            bufsize=-1,
+            check=False,
+        )
+
+    def test_nonzero_returncode(self):
+        self.run_mock.return_value = mock.Mock(returncode=1, stdout=b"")
+        self.assertFalse(process_helper(["false"], env={}))
+
+    def test_failure_in_output(self):
+        for output in (b"Failure: nope", b"failure: nope", b"FAILURE"):
+            self.run_mock.return_value = mock.Mock(returncode=0, stdout=output)
+            self.assertFalse(process_helper(["cmd"], env={}))
+
+    @mock.patch("charm.traceback.format_stack")
+    def test_failure_stack_only_logged_for_debug(self, format_stack_mock):
+        """
+        The stack is only formatted for failed commands when debug logging is on
+        """
+        self.run_mock.return_value = mock.Mock(returncode=1, stdout=b"")
+        with mock.patch.object(charm.logger, "isEnabledFor", return_value=False):
+            process_helper(["false"], env={})
+        format_stack_mock.assert_not_called()
+
+        with mock.patch.object(charm.logger, "isEnabledFor", return_value=True):
+            process_helper(["false"], env={})
+        format_stack_mock.assert_called_once_with()
+
+    def test_exception(self):
+        self.run_mock.side_effect = FileNotFoundError
+        self.assertFalse(process_helper(["missing"], env={}))
+
+
+class TestMergeClientConfig(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.conf_file = os.path.join(tmpdir.name, "client.conf")
+
+    def test_merge_preserves_existing_values(self):
+        """
+        Existing keys and sections are kept, and new keys are added to [client].
+        """
+        with open(self.conf_file, "w") as fp:
+            fp.write("[client]\naccount_name = onward\n\n[other]\nfoo = bar\n")
+
+        merge_client_config(self.conf_file, {"ping_url": "url", "url": None})
+
+        with open(self.conf_file) as fp:
+            text = fp.read()
+        self.assertEqual(
+            "[client]\naccount_name = onward\nping_url = url\n\n"
+            "[other]\nfoo = bar\n\n",
+            text,
+        )
+
+    def test_merge_keeps_colon_and_continuation_values(self):
+        """
+        Values separated with `:` and values continued on indented lines are kept.
+        """
+        with open(self.conf_file, "w") as fp:
+            fp.write("[client]\nurl: https://x\ntags = a,\n  b\n# comment\nURL_2 = y\n")
+
+        merge_client_config(self.conf_file, {"ping_url": "url"})
+
+        with open(self.conf_file) as fp:
+            text = fp.read()
+        self.assertEqual(
+            "[client]\nurl = https://x\ntags = a,\n\tb\nurl_2 = y\nping_url = url\n\n",
+            text,
+        )
+
+    def test_merge_multiline_value(self):
+        """
+        Multi-line values are written on indented continuation lines, so the file
+        can be merged again.
+        """
+        merge_client_config(self.conf_file, {"tags": "a\nb"})
+        merge_client_config(self.conf_file, {"tags": "a\nb"})
+
+        with open(self.conf_file) as fp:
+            self.assertEqual("[client]\ntags = a\n\tb\n\n", fp.read())
+
+    def test_merge_configparser_written_file(self):
+        """
+        A file written by ConfigParser, including an empty line inside a value and
+        a [DEFAULT] section, is merged without changing its values.
+        """
+        config = configparser.ConfigParser()
+        config["DEFAULT"] = {"data_path": "/srv/x"}
+        config["client"] = {"tags": "a,\n\nb", "url": "https://x"}
+        with open(self.conf_file, "w") as fp:
+            config.write(fp)
+
+        merged = merge_client_config(self.conf_file, {"ping_url": "url"})
+        self.assertEqual(
+            {
+                "data_path": "/srv/x",
+                "tags": "a,\n\nb",
+                "url": "https://x",
+                "ping_url": "url",
+            },
+            merged,
+        )
+
+        written = configparser.ConfigParser()
+        written.read(self.conf_file)
+        self.assertEqual({"data_path": "/srv/x"}, dict(written.defaults()))
+        self.assertEqual(merged, dict(written["client"]))
+
+    def test_merge_is_stable(self):
+        """
+        Merging the same values into a ConfigParser-written file twice gives the
+        same file.
+        """
+        config = configparser.ConfigParser()
+        config["client"] = {"tags": "a,\n\nb"}
+        with open(self.conf_file, "w") as fp:
+            config.write(fp)
+
+        merge_client_config(self.conf_file, {"ping_url": "url"})
+        with open(self.conf_file) as fp:
+            first = fp.read()
+        merge_client_config(self.conf_file, {"ping_url": "url"})
+        with open(self.conf_file) as fp:
+            self.assertEqual(first, fp.read())
+
+    def test_merge_malformed_line(self):
+        """
+        A line that cannot be parsed raises a `ClientCharmError` and leaves the
+        file untouched.
+        """
+        with open(self.conf_file, "w") as fp:
+            fp.write("[client]\nnakedkey\n")
+
+        with self.assertRaises(ClientCharmError):
+            merge_client_config(self.conf_file, {"ping_url": "url"})
+
+        with open(self.conf_file) as fp:
+            self.assertEqual("[client]\nnakedkey\n", fp.read())
+
+    def test_merge_returns_client_section(self):
+        """
+        The merged [client] section is returned.
+        """
+        with open(self.conf_file, "w") as fp:
+            fp.write("[client]\ndata_path = /srv/x\n")
+
+        self.assertEqual(
+            {"data_path": "/srv/x", "ping_url": "url"},
+            merge_client_config(self.conf_file, {"ping_url": "url"}),
+        )
+
+    def test_merge_missing_file(self):
+        """
+        A missing configuration file is created with a [client] section.
+        """
+        merge_client_config(self.conf_file, {"account_name": "onward"})
+
+        with open(self.conf_file) as fp:
+            self.assertEqual("[client]\naccount_name = onward\n\n", fp.read())
+
+    def test_merge_empty_file(self):
+        """
+        An empty configuration file is not read.
+        """
+        open(self.conf_file, "w").close()
+
+        with mock.patch("builtins.open", mock.mock_open()) as open_mock:
+            merge_client_config(self.conf_file, {"account_name": "onward"})
+
+        open_mock.assert_called_once_with(self.conf_file, "w")
+        open_mock().write.assert_called_once_with("[client]\naccount_name = onward\n\n")
+
+
 class TestGetAddtionalClientConfiguration(unittest.TestCase):
 
     def test_empty_additional_config(self):
@@ -359,6 +745,64 @@ class TestGetAddtionalClientConfiguration(unittest.TestCase):
         expected = {"somevalue": "somekey", "another_value": "another_key"}
         self.assertEqual(expected, get_additional_client_configuration(juju_config))
 
+    def test_other_sections_ignored(self):
+        """
+        Only the [client] section of additional-client-configuration is returned.
+        """
+        juju_config = {
+            "additional-client-configuration": "[other]\nfoo = bar\n[client]\nsomevalue = somekey\n[another]\nbaz = qux"
+        }
+        expected = {"somevalue": "somekey"}
+        self.assertEqual(expected, get_additional_client_configuration(juju_config))
+
+    def test_colon_delimiter(self):
+        """
+        Keys and values can be separated with `:`, as with ConfigParser
+        """
+        juju_config = {"additional-client-configuration": "[client]\nkey: value"}
+        self.assertEqual(
+            {"key": "value"}, get_additional_client_configuration(juju_config)
+        )
+
+    def test_keys_lowercased(self):
+        """
+        Keys are lowercased, as with ConfigParser
+        """
+        juju_config = {"additional-client-configuration": "[client]\nURL = x"}
+        self.assertEqual({"url": "x"}, get_additional_client_configuration(juju_config))
+
+    def test_crlf_line_endings(self):
+        """
+        CRLF line endings are accepted
+        """
+        juju_config = {"additional-client-configuration": "[client]\r\nfoo = bar\r\n"}
+        self.assertEqual(
+            {"foo": "bar"}, get_additional_client_configuration(juju_config)
+        )
+
+    def test_empty_line_in_continued_value(self):
+        """
+        Empty lines inside a continued value are kept, as with ConfigParser
+        """
+        juju_config = {
+            "additional-client-configuration": "[client]\ntags = a,\n\n  b\nfoo = bar"
+        }
+        self.assertEqual(
+            {"tags": "a,\n\nb", "foo": "bar"},
+            get_additional_client_configuration(juju_config),
+        )
+
+    def test_default_section_inherited(self):
+        """
+        Values in a [DEFAULT] section are included, as with ConfigParser
+        """
+        juju_config = {
+            "additional-client-configuration": "[DEFAULT]\nk = v\n[client]\na = b"
+        }
+        self.assertEqual(
+            {"k": "v", "a": "b"}, get_additional_client_configuration(juju_config)
+        )
+
     def test_malformed_additional_config(self):
         """
         A malformed additional config raises a `ClientCharmError` and includes the
@@ -370,6 +814,7 @@ class TestGetAddtionalClientConfiguration(unittest.TestCase):
             {"additional-client-configuration": "[notclientsection]"},
             {"additional-client-configuration": "nakedkey"},
             {"additional-client-configuration": "globalkey = value"},
+            {"additional-client-configuration": "[client]\nnakedkey"},
         )
 
         for invalid_config in invalid_configs: